@@ -1,9 +1,25 @@
+import argparse
+import builtins
 import collections
+import contextlib
 import dataclasses
+import importlib.util
 import json
 import os
+import random
+import select
+import shutil
+import socket
+import stat
+import subprocess
+import sys
+import tempfile
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import asdict
+from datetime import datetime
+from datetime import timedelta
 from glob import glob
 from pathlib import Path
 from typing import Any
@@ -30,6 +46,32 @@ def pytest_addoption(parser):
         default=[],
         help="Use a replay file to run the tests from that file only",
     )
+    group.addoption(
+        "--replay-order",
+        action="store",
+        dest="replay_order",
+        choices=["recorded", "fixtures"],
+        default="recorded",
+        help="Order of the tests when using --replay: 'recorded' (default) keeps the "
+        "order from the replay file, 'fixtures' groups tests sharing higher scoped "
+        "parametrized fixtures to minimize their setup and teardown.",
+    )
+    group.addoption(
+        "--replay-check-order",
+        action="store_true",
+        dest="check_order",
+        default=False,
+        help="Instead of running the tests from --replay, run them in different orders "
+        "and in isolation in parallel subprocesses, reporting order-dependent tests.",
+    )
+    group.addoption(
+        "--replay-shuffles",
+        action="store",
+        type=int,
+        dest="replay_shuffles",
+        default=3,
+        help="Number of random orders tried by --replay-check-order (default: 3).",
+    )
     group.addoption(
         "--replay-base-name",
         action="store",
@@ -45,6 +87,88 @@ def pytest_addoption(parser):
         help="Skips cleanup scripts before running (does not remove previously "
         "generated replay files).",
     )
+    group.addoption(
+        "--replay-keep-runs",
+        action="store",
+        type=int,
+        dest="keep_runs",
+        default=None,
+        metavar="N",
+        help="Record each run in its own subdirectory of --replay-record-dir, keeping "
+        "only the N most recent runs.",
+    )
+    group.addoption(
+        "--replay-keep-days",
+        action="store",
+        type=float,
+        dest="keep_days",
+        default=None,
+        metavar="DAYS",
+        help="Record each run in its own subdirectory of --replay-record-dir, removing "
+        "runs older than DAYS.",
+    )
+    group.addoption(
+        "--replay-keep-bytes",
+        action="store",
+        type=_parse_size,
+        dest="keep_bytes",
+        default=None,
+        metavar="SIZE",
+        help="Record each run in its own subdirectory of --replay-record-dir, removing "
+        "the oldest runs once all runs take more than SIZE (for example 500M).",
+    )
+    group.addoption(
+        "--replay-rerun-crashed",
+        action="store_true",
+        dest="rerun_crashed",
+        default=False,
+        help="When a pytest-xdist worker crashes, re-run its replay file in a background "
+        "process while the session continues, reporting the result at the end.",
+    )
+    group.addoption(
+        "--replay-rerun-timeout",
+        action="store",
+        type=float,
+        dest="rerun_timeout",
+        default=600.0,
+        metavar="SECONDS",
+        help="How long the end of the session waits for the --replay-rerun-crashed "
+        "processes before terminating them (default: 600).",
+    )
+    group.addoption(
+        "--replay-stream",
+        action="store",
+        dest="replay_stream",
+        default=None,
+        metavar="PATH",
+        help="Also publish each record to the Unix datagram socket or named pipe at "
+        "PATH, dropping records whenever it is not ready to receive them.",
+    )
+    group.addoption(
+        "--replay-stats",
+        action="store_true",
+        dest="replay_stats",
+        default=False,
+        help="Show the time spent in pytest-replay's own hooks at the end of the run.",
+    )
+    group.addoption(
+        "--replay-record-imports",
+        action="store_true",
+        dest="record_imports",
+        default=False,
+        help="Record the modules imported for the first time by each test and the "
+        "time spent importing them.",
+    )
+
+
+def _parse_size(value: str) -> int:
+    units = {"K": 1024, "M": 1024**2, "G": 1024**3}
+    try:
+        if value[-1:].upper() in units:
+            return int(float(value[:-1]) * units[value[-1].upper()])
+        return int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid size: {value!r}")
 
 
 @dataclasses.dataclass
@@ -55,17 +179,265 @@ class ReplayTestInfo:
     outcome: Optional[str] = None
     metadata: dict[str, Any] = dataclasses.field(default_factory=dict)
     xdist_group: Optional[str] = None
+    imports: Optional[dict[str, Any]] = None
 
     def to_clean_dict(self) -> dict[str, Any]:
         return {k: v for k, v in asdict(self).items() if v}
 
 
+# Clock for measuring durations (plugin overhead, imports), kept apart from the
+# ``time.perf_counter`` calls giving the record timestamps, so those can be replaced
+# in this module to produce predictable records without skewing the measurements.
+_clock = time.perf_counter
+
+# Hooks and methods of ``ReplayPlugin`` measured in ``ReplayPlugin.stats``.
+_MEASURED_HOOKS = (
+    "pytest_runtest_logstart",
+    "pytest_runtest_makereport",
+    "pytest_collection_modifyitems",
+    "cleanup_scripts",
+    "append_test_to_script",
+)
+
+
+@dataclasses.dataclass
+class ReplayHookStats:
+    """Cumulative cost of one of the hooks of ``ReplayPlugin``."""
+
+    calls: int = 0
+    total: float = 0.0
+    max: float = 0.0
+    bytes_written: int = 0
+
+    def measure(self) -> "_HookTimer":
+        return _HookTimer(self)
+
+    def merge(self, other: "ReplayHookStats") -> None:
+        self.calls += other.calls
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        self.bytes_written += other.bytes_written
+
+
+class _HookTimer:
+    """
+    Measures a call, excluding the time of the measured calls nested in it (e.g.
+    ``append_test_to_script`` called from ``pytest_runtest_logstart``), so the totals
+    of all hooks add up to the overhead of the plugin.
+    """
+
+    __slots__ = ("stats", "start", "nested")
+
+    # Timers currently running, innermost last.
+    _active: list["_HookTimer"] = []
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def __enter__(self):
+        self.nested = 0.0
+        self._active.append(self)
+        self.start = _clock()
+        return self.stats
+
+    def __exit__(self, *exc_info):
+        elapsed = _clock() - self.start
+        self._active.pop()
+        if self._active:
+            self._active[-1].nested += elapsed
+        elapsed -= self.nested
+        self.stats.calls += 1
+        self.stats.total += elapsed
+        if elapsed > self.stats.max:
+            self.stats.max = elapsed
+
+
 class _ReplayTestInfoDefaultDict(collections.defaultdict):
     def __missing__(self, key):
         self[key] = ReplayTestInfo(nodeid=key)
         return self[key]
 
 
+def load_replay_files(replay_files) -> dict[str, ReplayTestInfo]:
+    """
+    Load the tests from the given replay files, in the order they should run.
+
+    Each test maps to its last finished record, or to its last record if it never
+    finished (crashed). When loading more than one file, the tests of each file are
+    assigned to their own ``xdist_group``.
+    """
+    enable_xdist = len(replay_files) > 1
+
+    # Use a dict to deduplicate the node ids while keeping the order.
+    nodeids: dict[str, ReplayTestInfo] = {}
+    for num, single_rep in enumerate(replay_files):
+        with open(single_rep, encoding="UTF-8") as f:
+            for line in f.readlines():
+                stripped = line.strip()
+                # Ignore blank lines and comments. (#70)
+                if stripped and not stripped.startswith(("#", "//")):
+                    node_info = json.loads(stripped)
+                    nodeid = node_info["nodeid"]
+                    if enable_xdist:
+                        node_info["xdist_group"] = f"replay-gw{num}"
+                    previous = nodeids.get(nodeid)
+                    if (
+                        "finish" in node_info
+                        or previous is None
+                        or (previous.finish is None)
+                    ):
+                        nodeids[nodeid] = ReplayTestInfo(**node_info)
+    return nodeids
+
+
+class _ImportTracker:
+    """
+    Measures the modules imported for the first time while a test runs.
+
+    Wraps ``builtins.__import__`` so only outermost ``import`` statements on the main
+    thread are timed; imports done through ``importlib.import_module`` are still
+    counted in the ``sys.modules`` delta, but not timed.
+    """
+
+    # Maximum number of imports kept per test, most expensive first.
+    max_entries = 5
+
+    def __init__(self):
+        self._original_import = None
+        self._thread_id = threading.get_ident()
+        self._depth = 0
+        self._modules_before = None
+        self._entries = []
+
+    def install(self):
+        self._original_import = builtins.__import__
+        builtins.__import__ = self._import
+
+    def uninstall(self):
+        if self._original_import is not None:
+            builtins.__import__ = self._original_import
+            self._original_import = None
+
+    def start(self):
+        self._modules_before = set(sys.modules)
+        self._entries = []
+
+    def stop(self) -> Optional[dict[str, Any]]:
+        if self._modules_before is None:
+            return None
+        new_modules = len(sys.modules.keys() - self._modules_before)
+        self._modules_before = None
+        if not new_modules:
+            return None
+        entries = sorted(self._entries, key=lambda x: x[1], reverse=True)
+        return {
+            "modules": new_modules,
+            "time": sum(elapsed for _, elapsed in self._entries),
+            "top": [list(x) for x in entries[: self.max_entries]],
+        }
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if (
+            self._modules_before is None
+            or self._depth
+            or threading.get_ident() != self._thread_id
+        ):
+            return self._original_import(name, globals, locals, fromlist, level)
+        target = _resolve_import_name(name, globals, level)
+        # ``from pkg import sub`` with ``pkg`` already imported only loads ``pkg.sub``,
+        # which is what the entry should be named after.
+        submodules = []
+        if fromlist and target in sys.modules:
+            submodules = [
+                f"{target}.{x}"
+                for x in fromlist
+                if x != "*" and f"{target}.{x}" not in sys.modules
+            ]
+        count_before = len(sys.modules)
+        self._depth += 1
+        start = _clock()
+        try:
+            return self._original_import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = _clock() - start
+            self._depth -= 1
+            if len(sys.modules) > count_before:
+                loaded = [x for x in submodules if x in sys.modules]
+                self._entries.append((", ".join(loaded) or target, elapsed))
+
+
+def _resolve_import_name(name, globals, level):
+    if not level:
+        return name
+    try:
+        return importlib.util.resolve_name(
+            "." * level + name, (globals or {}).get("__package__")
+        )
+    except (ImportError, ValueError):
+        return name
+
+
+class _RecordStream:
+    """
+    Publishes records to a Unix datagram socket or to a named pipe without ever
+    blocking: records are dropped (and counted) whenever nobody is listening or the
+    consumer is not keeping up.
+    """
+
+    # Larger messages are dropped, so consumers can always receive them whole.
+    max_message_size = 65536
+
+    def __init__(self, path):
+        if not hasattr(socket, "AF_UNIX"):
+            raise pytest.UsageError("--replay-stream requires Unix domain sockets.")
+        self.path = os.path.abspath(path)
+        self.dropped = 0
+        self._fifo_fd = None
+        self._socket = None
+        if os.path.exists(self.path) and stat.S_ISFIFO(os.stat(self.path).st_mode):
+            self._fifo = True
+        else:
+            # The consumer might bind the socket only after the session starts.
+            self._fifo = False
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._socket.setblocking(False)
+
+    def publish(self, message):
+        data = message.encode("UTF-8")
+        if len(data) > self.max_message_size:
+            self.dropped += 1
+            return
+        try:
+            if self._fifo:
+                self._write_fifo(data + b"\n")
+            else:
+                self._socket.sendto(data, self.path)
+        except OSError:
+            self.dropped += 1
+
+    def _write_fifo(self, data):
+        # Larger writes are not atomic, so could interleave with other workers.
+        if len(data) > select.PIPE_BUF:
+            raise BlockingIOError
+        if self._fifo_fd is None:
+            # Fails with ENXIO until a reader opens the pipe.
+            self._fifo_fd = os.open(self.path, os.O_WRONLY | os.O_NONBLOCK)
+        try:
+            os.write(self._fifo_fd, data)
+        except BrokenPipeError:
+            # The reader went away, try to open the pipe again on the next record.
+            self.close()
+            raise
+
+    def close(self):
+        if self._fifo_fd is not None:
+            os.close(self._fifo_fd)
+            self._fifo_fd = None
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+
 class ReplayPlugin:
     def __init__(self, config):
         self.dir = config.getoption("replay_record_dir")
@@ -77,11 +449,58 @@ class ReplayPlugin:
         self.xdist_worker_name = os.environ.get("PYTEST_XDIST_WORKER", "")
         self.ext = ".txt"
         self.written_nodeids = set()
+        # Overhead of the plugin itself, also merged from xdist workers by DeferPlugin.
+        self.stats = {name: ReplayHookStats() for name in _MEASURED_HOOKS}
+        self.show_stats = config.getoption("replay_stats")
+        # Sessions launched by this plugin (crash reruns, order check variants) only
+        # record where they are told to, ignoring the options from ini/env addopts
+        # which would act on the records of the launching session.
+        self.launched = bool(os.environ.get(_LAUNCHED_ENV_VAR))
+        self.keep_runs = self.keep_days = self.keep_bytes = None
+        if not self.launched:
+            self.keep_runs = config.getoption("keep_runs")
+            self.keep_days = config.getoption("keep_days")
+            self.keep_bytes = config.getoption("keep_bytes")
+        if self.keep_runs is not None and self.keep_runs < 1:
+            raise pytest.UsageError("--replay-keep-runs must be at least 1.")
+        # When keeping previous runs, each run is recorded in its own subdirectory.
+        self.root_dir = self.dir
+        self.run_name = None
+        if self.dir and any(
+            x is not None for x in (self.keep_runs, self.keep_days, self.keep_bytes)
+        ):
+            if hasattr(config, "workerinput"):
+                self.run_name = config.workerinput["replay_run_name"]
+            else:
+                self.run_name = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+            self.dir = os.path.join(self.root_dir, self.run_name)
         skip_cleanup = config.getoption("skip_cleanup", False)
-        if not skip_cleanup:
+        if self.run_name:
+            self.start_run(prune=not skip_cleanup)
+        elif not skip_cleanup:
             self.cleanup_scripts()
         self.nodes = _ReplayTestInfoDefaultDict()
         self.session_start_time = config.replay_start_time
+        self.config = config
+        self.import_tracker = None
+        recording = self.dir and not (self.running_xdist and not self.xdist_worker_name)
+        if recording and config.getoption("record_imports"):
+            self.import_tracker = _ImportTracker()
+            self.import_tracker.install()
+        # Per-test import costs, also merged from xdist workers by DeferPlugin.
+        self.import_costs: dict[str, dict[str, Any]] = {}
+        self.rerun_crashed = config.getoption("rerun_crashed") and not self.launched
+        # Crashed xdist workers (id -> nodeid that crashed it), filled by DeferPlugin.
+        self.crashed_workers: dict[str, str] = {}
+        self.crash_reruns: dict[str, subprocess.Popen] = {}
+        self.check_order = config.getoption("check_order") and not self.launched
+        self.order_check = None
+        self.stream = None
+        # Records which could not be published, including those of xdist workers.
+        self.stream_dropped = 0
+        stream_path = config.getoption("replay_stream")
+        if stream_path and not self.launched:
+            self.stream = _RecordStream(stream_path)
 
     @pytest.fixture(scope="function")
     def replay_metadata(self, request):
@@ -92,105 +511,468 @@ class ReplayPlugin:
             # only cleanup scripts on the master node
             return
         if self.dir:
-            if os.path.isdir(self.dir):
-                if self.running_xdist:
-                    mask = os.path.join(
-                        self.dir, self.base_script_name + "-*" + self.ext
-                    )
+            with self.stats["cleanup_scripts"].measure():
+                if os.path.isdir(self.dir):
+                    if self.running_xdist:
+                        masks = [
+                            os.path.join(self.dir, self.base_script_name + "-*" + ext)
+                            for ext in (self.ext, ".log")
+                        ]
+                    else:
+                        masks = [
+                            os.path.join(self.dir, self.base_script_name + self.ext)
+                        ]
+                    for mask in masks:
+                        for fn in glob(mask):
+                            os.remove(fn)
+                    # Records and temporary files of crashed worker reruns.
+                    rerun_mask = self.base_script_name + "-*-rerun"
+                    for fn in glob(os.path.join(self.dir, rerun_mask)):
+                        shutil.rmtree(fn, ignore_errors=True)
                 else:
-                    mask = os.path.join(self.dir, self.base_script_name + self.ext)
-                for fn in glob(mask):
-                    os.remove(fn)
+                    os.makedirs(self.dir)
+
+    def run_index_path(self):
+        return os.path.join(self.root_dir, self.base_script_name + "-runs.json")
+
+    def start_run(self, prune):
+        if self.xdist_worker_name:
+            return
+        os.makedirs(self.dir)
+        with _locked_run_index(self.run_index_path()) as runs:
+            if prune:
+                with self.stats["cleanup_scripts"].measure():
+                    runs[:] = self.prune_runs(runs)
+            runs.insert(
+                0,
+                {
+                    "name": self.run_name,
+                    "start": datetime.now().isoformat(),
+                    "host": socket.gethostname(),
+                    "pid": os.getpid(),
+                },
+            )
+
+    def prune_runs(self, runs):
+        """Remove the runs exceeding the retention policy, returning the ones kept."""
+        now = datetime.now()
+        kept = []
+        total_bytes = 0
+        # Runs are sorted from the newest to the oldest.
+        for run in runs:
+            path = os.path.join(self.root_dir, run["name"])
+            if not os.path.isdir(path):
+                continue
+            size = run.get("bytes")
+            if size is None:
+                # The run did not finish (crashed or is still running).
+                size = sum(f.stat().st_size for f in os.scandir(path) if f.is_file())
+            total_bytes += size
+            if "exitstatus" not in run and _run_may_be_active(run):
+                kept.append(run)
+                continue
+            expired = (
+                # Leave room for the run starting now.
+                (self.keep_runs is not None and len(kept) >= self.keep_runs - 1)
+                or (
+                    self.keep_days is not None
+                    and now - datetime.fromisoformat(run["start"])
+                    > timedelta(days=self.keep_days)
+                )
+                or (self.keep_bytes is not None and total_bytes > self.keep_bytes)
+            )
+            if expired:
+                shutil.rmtree(path, ignore_errors=True)
             else:
-                os.makedirs(self.dir)
+                kept.append(run)
+        return kept
+
+    def finish_run(self, exitstatus):
+        files = sorted(os.scandir(self.dir), key=lambda f: f.name)
+        with _locked_run_index(self.run_index_path()) as runs:
+            for run in runs:
+                if run["name"] == self.run_name:
+                    run["files"] = [f.name for f in files]
+                    run["bytes"] = sum(f.stat().st_size for f in files)
+                    run["exitstatus"] = int(exitstatus)
 
     def pytest_runtest_logstart(self, nodeid):
         if self.running_xdist and not self.xdist_worker_name:
             # only workers report running tests when running in xdist
             return
         if self.dir:
-            self.nodes[nodeid].start = time.perf_counter() - self.session_start_time
-            json_content = json.dumps(self.nodes[nodeid].to_clean_dict())
-            self.append_test_to_script(nodeid, json_content)
+            with self.stats["pytest_runtest_logstart"].measure():
+                self.nodes[nodeid].start = time.perf_counter() - self.session_start_time
+                json_content = json.dumps(self.nodes[nodeid].to_clean_dict())
+                self.append_test_to_script(nodeid, json_content)
+                if self.import_tracker:
+                    self.import_tracker.start()
 
     @pytest.hookimpl(hookwrapper=True)
     def pytest_runtest_makereport(self, item):
         report = yield
         result = report.get_result()
         if self.dir:
-            self.nodes[item.nodeid].outcome = (
-                self.nodes[item.nodeid].outcome or result.outcome
-            )
-            current = self.nodes[item.nodeid].outcome
-            if not result.passed and current != "failed":
-                # do not overwrite a failed outcome with a skipped one
-                self.nodes[item.nodeid].outcome = result.outcome
-
-            if result.when == "teardown":
-                self.nodes[item.nodeid].finish = (
-                    time.perf_counter() - self.session_start_time
+            # Only measure our own processing of the report, not the other hooks.
+            with self.stats["pytest_runtest_makereport"].measure():
+                self.nodes[item.nodeid].outcome = (
+                    self.nodes[item.nodeid].outcome or result.outcome
                 )
-                json_content = json.dumps(self.nodes[item.nodeid].to_clean_dict())
-                self.append_test_to_script(item.nodeid, json_content)
+                current = self.nodes[item.nodeid].outcome
+                if not result.passed and current != "failed":
+                    # do not overwrite a failed outcome with a skipped one
+                    self.nodes[item.nodeid].outcome = result.outcome
+
+                if result.when == "teardown":
+                    self.nodes[item.nodeid].finish = (
+                        time.perf_counter() - self.session_start_time
+                    )
+                    if self.import_tracker:
+                        imports = self.import_tracker.stop()
+                        if imports:
+                            self.nodes[item.nodeid].imports = imports
+                            self.import_costs[item.nodeid] = imports
+                    json_content = json.dumps(self.nodes[item.nodeid].to_clean_dict())
+                    self.append_test_to_script(item.nodeid, json_content)
 
     def pytest_collection_modifyitems(self, items, config):
         replay_files = config.getoption("replay_files")
         if not replay_files:
             return
 
-        enable_xdist = len(replay_files) > 1
-
-        # Use a dict to deduplicate the node ids while keeping the order.
-        nodeids = {}
-        for num, single_rep in enumerate(replay_files):
-            with open(single_rep, encoding="UTF-8") as f:
-                for line in f.readlines():
-                    stripped = line.strip()
-                    # Ignore blank lines and comments. (#70)
-                    if stripped and not stripped.startswith(("#", "//")):
-                        node_info = json.loads(stripped)
-                        nodeid = node_info["nodeid"]
-                        if enable_xdist:
-                            node_info["xdist_group"] = f"replay-gw{num}"
-                        if "finish" in node_info:
-                            self.nodes[nodeid] = ReplayTestInfo(**node_info)
-                        nodeids[nodeid] = None
-
-        items_dict = {item.nodeid: item for item in items}
-        remaining = []
-        # Make sure to respect the order from the JSON file (#52).
-        for nodeid in nodeids:
-            try:
-                item = items_dict.pop(nodeid)
-            except KeyError:
-                # raise a meaningful error if a test is missing from the collection (#99)
-                raise pytest.UsageError(
-                    "Test with nodeid {!r} not found.".format(nodeid)
+        with self.stats["pytest_collection_modifyitems"].measure():
+            nodeids = load_replay_files(replay_files)
+            for nodeid, info in nodeids.items():
+                if info.finish is not None:
+                    # Import costs are only recorded as measured in this run.
+                    info.imports = None
+                    self.nodes[nodeid] = info
+
+            items_dict = {item.nodeid: item for item in items}
+            remaining = []
+            # Make sure to respect the order from the JSON file (#52).
+            for nodeid in nodeids:
+                try:
+                    item = items_dict.pop(nodeid)
+                except KeyError:
+                    # raise a meaningful error if a test is missing from the collection (#99)
+                    raise pytest.UsageError(
+                        "Test with nodeid {!r} not found.".format(nodeid)
+                    )
+                else:
+                    if item:
+                        if xdist_group := self.nodes[nodeid].xdist_group:
+                            item.add_marker(pytest.mark.xdist_group(name=xdist_group))
+                        remaining.append(item)
+            deselected = list(items_dict.values())
+
+            if deselected:
+                config.hook.pytest_deselected(items=deselected)
+
+            if config.getoption("replay_order") == "fixtures":
+                remaining = _group_by_scoped_fixtures(remaining)
+
+            items[:] = remaining
+
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_runtestloop(self, session):
+        if not self.check_order:
+            return None
+        if session.config.option.collectonly:
+            return True
+        replayed = load_replay_files(self.config.getoption("replay_files"))
+        workdir, variants = _check_order(self.config, replayed)
+        order_dependent, always_failing = _find_order_dependent(
+            list(replayed), variants
+        )
+        self.order_check = (workdir, variants, order_dependent, always_failing)
+        # Makes the session exit with TESTS_FAILED.
+        session.testsfailed = len(order_dependent)
+        return True
+
+    def pytest_sessionfinish(self, session):
+        if self.import_tracker:
+            self.import_tracker.uninstall()
+        if self.stream:
+            self.stream.close()
+            self.stream_dropped += self.stream.dropped
+        if self.run_name and not self.xdist_worker_name:
+            self.finish_run(session.exitstatus)
+        if hasattr(self.config, "workeroutput"):
+            self.config.workeroutput["replay_import_costs"] = self.import_costs
+            self.config.workeroutput["replay_stats"] = {
+                name: dataclasses.asdict(stats) for name, stats in self.stats.items()
+            }
+            self.config.workeroutput["replay_stream_dropped"] = self.stream_dropped
+
+    def handle_crashed_worker(self, worker_name, nodeid):
+        if not self.dir:
+            return
+        self.crashed_workers[worker_name] = nodeid
+        if self.rerun_crashed:
+            script = self.script_path(worker_name)
+            rerun_dir = os.path.splitext(script)[0] + "-rerun"
+            with open(rerun_dir + ".log", "w", encoding="UTF-8") as f:
+                self.crash_reruns[worker_name] = subprocess.Popen(
+                    _subprocess_command(
+                        self.config,
+                        f"--replay={script}",
+                        f"--replay-record-dir={rerun_dir}",
+                        f"--basetemp={os.path.join(rerun_dir, 'tmp')}",
+                    ),
+                    cwd=self.config.invocation_params.dir,
+                    env=_launched_env(),
+                    stdout=f,
+                    stderr=subprocess.STDOUT,
                 )
-            else:
-                if item:
-                    if xdist_group := self.nodes[nodeid].xdist_group:
-                        item.add_marker(pytest.mark.xdist_group(name=xdist_group))
-                    remaining.append(item)
-        deselected = list(items_dict.values())
 
-        if deselected:
-            config.hook.pytest_deselected(items=deselected)
+    def pytest_terminal_summary(self, terminalreporter):
+        if self.crashed_workers:
+            self.summarize_crashed_workers(terminalreporter)
+        if self.import_costs:
+            self.summarize_import_costs(terminalreporter)
+        if self.show_stats:
+            self.summarize_stats(terminalreporter)
+        if self.order_check:
+            self.summarize_order_check(terminalreporter)
+        if self.stream_dropped:
+            terminalreporter.write_line(
+                f"replay: {self.stream_dropped} records could not be published to "
+                f"{self.stream.path}",
+                yellow=True,
+            )
 
-        items[:] = remaining
+    def summarize_order_check(self, tr):
+        workdir, variants, order_dependent, always_failing = self.order_check
+        tr.write_sep("=", "replay order check")
+        tests = len(variants[0].nodeids)
+        tr.write_line(f"{len(variants)} variants of {tests} tests run in {workdir}")
+        for found in order_dependent:
+            tr.write_line(f"{found.nodeid} is order-dependent", red=True)
+            tr.write_line(f"    failed in: {', '.join(found.failing)}")
+            tr.write_line(f"    passed in: {', '.join(found.passing)}")
+            if found.polluters:
+                tr.write_line(f"    suspected polluters: {', '.join(found.polluters)}")
+            if found.enablers:
+                tr.write_line(f"    only passes after: {', '.join(found.enablers)}")
+        for nodeid in always_failing:
+            tr.write_line(f"{nodeid} fails in every order")
+        if not order_dependent:
+            tr.write_line("no order-dependent tests found", green=True)
+
+    def summarize_stats(self, tr):
+        tr.write_sep("=", "replay plugin overhead")
+        width = max(len(name) for name in self.stats)
+        tr.write_line(
+            f"{'':{width}} {'calls':>8} {'total':>10} {'max':>10} {'written':>12}"
+        )
+        for name, stats in self.stats.items():
+            tr.write_line(
+                f"{name:{width}} {stats.calls:8} {stats.total:9.4f}s "
+                f"{stats.max:9.4f}s {stats.bytes_written:12}"
+            )
+
+    def summarize_crashed_workers(self, tr):
+        tr.write_sep("=", "replay crashed workers")
+        # All reruns share the same time budget.
+        timeout = self.config.getoption("rerun_timeout")
+        deadline = time.monotonic() + timeout
+        for worker_name, nodeid in self.crashed_workers.items():
+            script = self.script_path(worker_name)
+            tr.write_line(f"{worker_name} crashed while running {nodeid}, replay with:")
+            tr.write_line(f"    pytest --replay={script}")
+            if process := self.crash_reruns.get(worker_name):
+                log = os.path.splitext(script)[0] + "-rerun.log"
+                try:
+                    returncode = process.wait(max(0.0, deadline - time.monotonic()))
+                except subprocess.TimeoutExpired:
+                    process.kill()
+                    process.wait()
+                    tr.write_line(
+                        f"    rerun did not finish within {timeout:g}s and was "
+                        f"terminated, log: {log}",
+                        yellow=True,
+                    )
+                else:
+                    tr.write_line(
+                        f"    rerun exited with code {returncode}, log: {log}"
+                    )
+
+    def summarize_import_costs(self, tr):
+        costs = sorted(
+            (
+                (elapsed, name, nodeid)
+                for nodeid, imports in self.import_costs.items()
+                for name, elapsed in imports["top"]
+            ),
+            reverse=True,
+        )
+        tr.write_sep("=", "replay import cost")
+        total = sum(x["time"] for x in self.import_costs.values())
+        tr.write_line(
+            f"{total:.2f}s spent in first-time imports across "
+            f"{len(self.import_costs)} tests, most expensive:"
+        )
+        for elapsed, name, nodeid in costs[:10]:
+            tr.write_line(f"{elapsed:.3f}s {name} (paid by {nodeid})")
+
+    def script_path(self, worker_name):
+        suffix = "-" + worker_name if worker_name else ""
+        return os.path.join(self.dir, self.base_script_name + suffix + self.ext)
 
     def append_test_to_script(self, nodeid, line):
-        suffix = "-" + self.xdist_worker_name if self.xdist_worker_name else ""
-        fn = os.path.join(self.dir, self.base_script_name + suffix + self.ext)
-        with open(fn, "a", encoding="UTF-8") as f:
-            f.write(line + "\n")
-            f.flush()
-            self.written_nodeids.add(nodeid)
+        with self.stats["append_test_to_script"].measure() as stats:
+            fn = self.script_path(self.xdist_worker_name)
+            with open(fn, "a", encoding="UTF-8") as f:
+                # Records are plain ASCII, as json.dumps escapes everything else.
+                stats.bytes_written += f.write(line + "\n")
+                f.flush()
+                self.written_nodeids.add(nodeid)
+            if self.stream:
+                worker = json.dumps(self.xdist_worker_name)
+                self.stream.publish(f'{{"worker": {worker}, "record": {line}}}')
+
+
+def _load_run_index(path) -> list[dict[str, Any]]:
+    if not os.path.isfile(path):
+        return []
+    with open(path, encoding="UTF-8") as f:
+        return json.load(f)["runs"]
+
+
+def _write_run_index(path, runs):
+    # Replace the index atomically, as other tools might be reading it.
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="UTF-8") as f:
+        json.dump({"runs": runs}, f, indent=1)
+    os.replace(tmp, path)
+
+
+@contextlib.contextmanager
+def _locked_run_index(path, stale_after=30.0):
+    """
+    Loads the runs of the index for updating them in place, writing them back at the
+    end, while holding a lock file so concurrent sessions do not lose each other's
+    updates. A lock older than ``stale_after`` seconds is assumed to be left over by
+    a session which died while holding it.
+    """
+    lock = path + ".lock"
+    while True:
+        try:
+            fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                if time.time() - os.stat(lock).st_mtime > stale_after:
+                    os.remove(lock)
+            except FileNotFoundError:
+                pass
+            time.sleep(0.01)
+        else:
+            break
+    try:
+        runs = _load_run_index(path)
+        yield runs
+        _write_run_index(path, runs)
+    finally:
+        os.close(fd)
+        os.remove(lock)
+
+
+def _run_may_be_active(run) -> bool:
+    """Whether the session recording an unfinished run might still be running."""
+    if run.get("host") != socket.gethostname() or "pid" not in run:
+        # Cannot tell, a session on another machine might be writing to it.
+        return True
+    if sys.platform == "win32":
+        # os.kill() terminates the process on Windows.
+        return True
+    try:
+        os.kill(run["pid"], 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+# Fixture scopes that outlive a single test, from the widest to the narrowest.
+_GROUPING_SCOPES = ("session", "package", "module", "class")
+
+
+def _scoped_fixtures_key(item) -> tuple:
+    """
+    Key identifying the higher scoped fixture instances used by ``item``: one entry
+    per scope in ``_GROUPING_SCOPES``, with the node owning that scope and the indexes
+    of the parametrized fixtures of that scope.
+    """
+    params = {scope: [] for scope in _GROUPING_SCOPES}
+    callspec = getattr(item, "callspec", None)
+    if callspec is not None:
+        name2fixturedefs = item._fixtureinfo.name2fixturedefs
+        for argname, index in callspec.indices.items():
+            fixturedefs = name2fixturedefs.get(argname)
+            if fixturedefs and fixturedefs[-1].scope in params:
+                params[fixturedefs[-1].scope].append((argname, index))
+
+    cls = item.getparent(pytest.Class)
+    owners = {
+        "session": "",
+        "package": str(item.path.parent),
+        "module": str(item.path),
+        "class": cls.nodeid if cls is not None else "",
+    }
+    return tuple((owners[scope], tuple(sorted(params[scope]))) for scope in params)
+
+
+def _group_by_scoped_fixtures(items):
+    """
+    Reorder ``items`` so tests sharing the same higher scoped fixture instances run
+    next to each other, setting up each instance only once.
+
+    Groups keep the order in which they first appear in ``items``, as do tests inside
+    each group; tests are never moved across ``xdist_group`` markers.
+    """
+    keys = {}
+    for item in items:
+        marker = item.get_closest_marker("xdist_group")
+        xdist_group = ""
+        if marker is not None:
+            xdist_group = marker.kwargs.get(
+                "name", marker.args[0] if marker.args else ""
+            )
+        keys[item] = (xdist_group,) + _scoped_fixtures_key(item)
+
+    def group(items, level):
+        if len(items) <= 1 or level == len(keys[items[0]]):
+            return items
+        buckets = {}
+        for item in items:
+            buckets.setdefault(keys[item][level], []).append(item)
+        return [x for bucket in buckets.values() for x in group(bucket, level + 1)]
+
+    return group(items, 0)
 
 
 class DeferPlugin:
     def pytest_configure_node(self, node):
         node.workerinput["replay_start_time"] = node.config.replay_start_time
+        replay = node.config.pluginmanager.get_plugin("replay-writer")
+        node.workerinput["replay_run_name"] = replay.run_name
+
+    def pytest_testnodedown(self, node, error):
+        workeroutput = getattr(node, "workeroutput", {})
+        replay = node.config.pluginmanager.get_plugin("replay-writer")
+        if costs := workeroutput.get("replay_import_costs"):
+            replay.import_costs.update(costs)
+        if stats := workeroutput.get("replay_stats"):
+            for name, values in stats.items():
+                replay.stats[name].merge(ReplayHookStats(**values))
+        replay.stream_dropped += workeroutput.get("replay_stream_dropped", 0)
+
+    @pytest.hookimpl(optionalhook=True)
+    def pytest_handlecrashitem(self, crashitem, report, sched):
+        replay = report.node.config.pluginmanager.get_plugin("replay-writer")
+        replay.handle_crashed_worker(report.node.gateway.id, crashitem)
 
 
 @pytest.hookimpl(tryfirst=True)
@@ -199,7 +981,13 @@ def pytest_load_initial_conftests(early_config, parser, args):
     is_xdist_enabled = early_config.pluginmanager.has_plugin(
         "xdist"
     ) or early_config.pluginmanager.has_plugin("xdist.plugin")
-    replay_files = parser.parse_known_args(args).replay_files
+    known_args = parser.parse_known_args(args)
+    replay_files = known_args.replay_files
+    if known_args.check_order:
+        # Variants run in their own subprocesses, one replay file at a time.
+        if is_xdist_enabled:
+            args.extend(["-n", "0"])
+        return
 
     if len(replay_files) > 1 and not is_xdist_enabled:
         raise pytest.UsageError(
@@ -221,7 +1009,210 @@ def pytest_load_initial_conftests(early_config, parser, args):
         args.extend(["-n", str(len(replay_files)), "--dist", "loadgroup"])
 
 
+# Options of this plugin which take no value; all others take one, except --replay.
+_REPLAY_FLAGS = (
+    "--replay-check-order",
+    "--replay-skip-cleanup",
+    "--replay-rerun-crashed",
+    "--replay-record-imports",
+    "--replay-stats",
+)
+
+
+# Set in the environment of the pytest sessions launched by this plugin.
+_LAUNCHED_ENV_VAR = "PYTEST_REPLAY_LAUNCHED"
+
+
+def _launched_env() -> dict[str, str]:
+    return {**os.environ, _LAUNCHED_ENV_VAR: "1"}
+
+
+def _subprocess_command(config, *args) -> list[str]:
+    """
+    Command running pytest in a single process with the same command line as this
+    session, except for the options of this plugin, which are replaced by ``args``.
+
+    The tests run in the order of the replay file, recording to ``.pytest-replay.txt``
+    and without touching the cache, even if addopts say otherwise. The process must
+    run with ``_launched_env()``, and ``args`` should include its own
+    ``--replay-record-dir`` and ``--basetemp``.
+    """
+    command = [sys.executable, "-m", "pytest"]
+    invocation_args = list(config.invocation_params.args)
+    while invocation_args:
+        arg = invocation_args.pop(0)
+        if not arg.startswith("--replay"):
+            command.append(arg)
+        elif arg == "--replay":
+            while invocation_args and not invocation_args[0].startswith("-"):
+                invocation_args.pop(0)
+        elif "=" not in arg and arg not in _REPLAY_FLAGS and invocation_args:
+            invocation_args.pop(0)
+    command.extend(
+        [
+            "--replay-base-name=.pytest-replay",
+            "--replay-order=recorded",
+            "-p",
+            "no:cacheprovider",
+            *args,
+        ]
+    )
+    if config.pluginmanager.has_plugin("xdist") or config.pluginmanager.has_plugin(
+        "xdist.plugin"
+    ):
+        # Override any -n given in addopts.
+        command.extend(["-n", "0"])
+    return command
+
+
+@dataclasses.dataclass
+class _OrderVariant:
+    """A replay of some of the tests in a given order, and the outcomes obtained."""
+
+    name: str
+    nodeids: list[str]
+    outcomes: dict[str, str] = dataclasses.field(default_factory=dict)
+
+    def preceding(self, nodeid) -> set[str]:
+        return set(self.nodeids[: self.nodeids.index(nodeid)])
+
+    def run(self, config, workdir):
+        script = os.path.join(workdir, self.name + ".txt")
+        with open(script, "w", encoding="UTF-8") as f:
+            f.writelines(json.dumps({"nodeid": x}) + "\n" for x in self.nodeids)
+        record_dir = os.path.join(workdir, self.name)
+        log_path = os.path.join(workdir, self.name + ".log")
+        with open(log_path, "w") as log:
+            returncode = subprocess.run(
+                _subprocess_command(
+                    config,
+                    f"--replay={script}",
+                    f"--replay-record-dir={record_dir}",
+                    # Variants run in parallel, each needs its own basetemp.
+                    f"--basetemp={os.path.join(workdir, self.name + '-tmp')}",
+                ),
+                cwd=config.invocation_params.dir,
+                env=_launched_env(),
+                stdout=log,
+                stderr=subprocess.STDOUT,
+            ).returncode
+        record = os.path.join(record_dir, ".pytest-replay.txt")
+        if not os.path.isfile(record) or returncode in (
+            pytest.ExitCode.INTERRUPTED,
+            pytest.ExitCode.INTERNAL_ERROR,
+            pytest.ExitCode.USAGE_ERROR,
+            pytest.ExitCode.NO_TESTS_COLLECTED,
+        ):
+            pytest.exit(
+                f"order check variant {self.name!r} failed with exit code "
+                f"{returncode}, see {log_path}",
+                returncode=pytest.ExitCode.INTERNAL_ERROR,
+            )
+        infos = load_replay_files([record])
+        for nodeid in self.nodeids:
+            if info := infos.get(nodeid):
+                self.outcomes[nodeid] = (
+                    info.outcome if info.finish is not None else "crashed"
+                )
+        return self
+
+
+def _run_order_variants(config, variants, workdir):
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        return list(executor.map(lambda v: v.run(config, workdir), variants))
+
+
+def _check_order(config, replayed) -> tuple[str, list[_OrderVariant]]:
+    """Run the replayed tests in different orders, returning the variants run."""
+    nodeids = list(replayed)
+    # The run directory when keeping previous runs.
+    workdir = config.pluginmanager.get_plugin("replay-writer").dir
+    if not workdir:
+        workdir = tempfile.mkdtemp(prefix="pytest-replay-")
+
+    def isolated(nodeid):
+        return _OrderVariant(f"isolated-{nodeids.index(nodeid)}", [nodeid])
+
+    variants = [
+        _OrderVariant("original", nodeids),
+        _OrderVariant("reversed", nodeids[::-1]),
+    ]
+    for seed in range(config.getoption("replay_shuffles")):
+        shuffled = nodeids[:]
+        random.Random(seed).shuffle(shuffled)
+        variants.append(_OrderVariant(f"shuffle-{seed}", shuffled))
+    # Failures recorded in the replay file are isolated right away, failures only
+    # seen in the variants are isolated in a second round.
+    recorded_failures = [
+        nodeid
+        for nodeid, info in replayed.items()
+        if info.outcome == "failed" or info.finish is None
+    ]
+    variants = _run_order_variants(
+        config, variants + [isolated(x) for x in recorded_failures], workdir
+    )
+    new_failures = {
+        nodeid
+        for v in variants
+        for nodeid, outcome in v.outcomes.items()
+        if outcome in ("failed", "crashed") and nodeid not in recorded_failures
+    }
+    variants += _run_order_variants(
+        config, [isolated(x) for x in nodeids if x in new_failures], workdir
+    )
+    return workdir, variants
+
+
+@dataclasses.dataclass
+class _OrderDependence:
+    """A test whose outcome depends on the tests run before it."""
+
+    nodeid: str
+    failing: list[str]
+    passing: list[str]
+    polluters: list[str]
+    enablers: list[str]
+
+
+def _find_order_dependent(nodeids, variants):
+    """
+    Return the tests failing in some variants but passing in others, and the tests
+    failing in every variant.
+    """
+    order_dependent = []
+    always_failing = []
+    for nodeid in nodeids:
+        ran = [v for v in variants if nodeid in v.outcomes]
+        failing = [v for v in ran if v.outcomes[nodeid] in ("failed", "crashed")]
+        passing = [v for v in ran if v.outcomes[nodeid] == "passed"]
+        if not failing:
+            continue
+        if not passing:
+            always_failing.append(nodeid)
+            continue
+        # Tests always running before it when it fails, but never when it passes,
+        # and vice versa.
+        polluters = set.intersection(*(v.preceding(nodeid) for v in failing))
+        polluters -= set().union(*(v.preceding(nodeid) for v in passing))
+        enablers = set.intersection(*(v.preceding(nodeid) for v in passing))
+        enablers -= set().union(*(v.preceding(nodeid) for v in failing))
+        order_dependent.append(
+            _OrderDependence(
+                nodeid,
+                failing=[v.name for v in failing],
+                passing=[v.name for v in passing],
+                polluters=[x for x in nodeids if x in polluters],
+                enablers=[x for x in nodeids if x in enablers],
+            )
+        )
+    return order_dependent, always_failing
+
+
 def pytest_configure(config):
+    if config.getoption("check_order") and not config.getoption("replay_files"):
+        raise pytest.UsageError("--replay-check-order requires --replay.")
+    if config.getoption("replay_stream") and not config.getoption("replay_record_dir"):
+        raise pytest.UsageError("--replay-stream requires --replay-record-dir.")
     if config.getoption("replay_record_dir") or config.getoption("replay_files"):
         if hasattr(config, "workerinput"):
             config.replay_start_time = config.workerinput["replay_start_time"]
@@ -239,4 +1230,8 @@ def pytest_configure(config):
 
 def pytest_report_header(config):
     if config.getoption("replay_record_dir"):
-        return "replay dir: {}".format(config.getoption("replay_record_dir"))
+        lines = ["replay dir: {}".format(config.getoption("replay_record_dir"))]
+        replay = config.pluginmanager.get_plugin("replay-writer")
+        if replay is not None and replay.run_name:
+            lines.append("replay run: {}".format(replay.run_name))
+        return lines
@@ -0,0 +1,130 @@
+"""
+Reference consumer for ``--replay-stream``: receives the records published by one or
+more pytest sessions and shows their progress, estimating the remaining time from the
+durations recorded in previous runs::
+
+    $ python -m pytest_replay.consumer /tmp/replay.sock --history build/replay/.pytest-replay*.txt
+"""
+
+import argparse
+import json
+import os
+import socket
+import stat
+import sys
+from typing import Any
+from typing import Optional
+
+from pytest_replay import _RecordStream
+from pytest_replay import load_replay_files
+
+
+class Progress:
+    """Aggregates streamed records into the progress of the run."""
+
+    def __init__(self, durations: Optional[dict[str, float]] = None):
+        self.durations = durations or {}
+        # Running tests (nodeid -> worker) and finished tests (nodeid -> outcome).
+        self.running: dict[str, str] = {}
+        self.finished: dict[str, str] = {}
+        self.workers: set[str] = set()
+
+    @classmethod
+    def from_history(cls, replay_files) -> "Progress":
+        durations = {
+            nodeid: info.finish - info.start
+            for nodeid, info in load_replay_files(replay_files).items()
+            if info.finish is not None
+        }
+        return cls(durations)
+
+    def feed(self, message: dict[str, Any]) -> None:
+        worker = message["worker"]
+        record = message["record"]
+        nodeid = record["nodeid"]
+        self.workers.add(worker)
+        if "finish" in record:
+            self.running.pop(nodeid, None)
+            self.finished[nodeid] = record.get("outcome", "")
+        else:
+            self.running[nodeid] = worker
+
+    def eta(self) -> Optional[float]:
+        """Estimated seconds left, assuming the known tests are spread over the workers."""
+        if not self.durations:
+            return None
+        remaining = sum(
+            duration
+            for nodeid, duration in self.durations.items()
+            if nodeid not in self.finished
+        )
+        return remaining / max(len(self.workers), 1)
+
+    def status_line(self) -> str:
+        total = max(len(self.durations), len(self.finished) + len(self.running))
+        failed = sum(1 for x in self.finished.values() if x == "failed")
+        line = (
+            f"{len(self.finished)}/{total} finished, {failed} failed, "
+            f"{len(self.running)} running"
+        )
+        if (eta := self.eta()) is not None:
+            line += f", ETA {eta:.0f}s"
+        return line
+
+
+def receive(path):
+    """
+    Yield the messages published to ``path``, a named pipe or a datagram socket,
+    skipping the ones which cannot be decoded.
+    """
+    if os.path.exists(path) and stat.S_ISFIFO(os.stat(path).st_mode):
+        while True:
+            # Blocks until a writer opens the pipe, ends when all writers close it.
+            with open(path, encoding="UTF-8") as f:
+                for line in f:
+                    yield from _decode(line)
+    else:
+        if os.path.exists(path):
+            os.remove(path)
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.bind(path)
+            try:
+                while True:
+                    yield from _decode(sock.recv(_RecordStream.max_message_size))
+            finally:
+                os.remove(path)
+
+
+def _decode(data):
+    try:
+        yield json.loads(data)
+    except ValueError:
+        pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m pytest_replay.consumer",
+        description="Show the progress of pytest sessions run with --replay-stream.",
+    )
+    parser.add_argument("path", help="Socket or named pipe given to --replay-stream.")
+    parser.add_argument(
+        "--history",
+        nargs="*",
+        default=[],
+        help="Record files of previous runs, used to estimate the remaining time.",
+    )
+    args = parser.parse_args(argv)
+    progress = Progress.from_history(args.history)
+    try:
+        for message in receive(args.path):
+            progress.feed(message)
+            if "finish" in message["record"]:
+                print(progress.status_line(), flush=True)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
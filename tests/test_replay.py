@@ -1,10 +1,17 @@
 import itertools as it
 import json
+import os
 import re
+import socket
+import subprocess
+import sys
 from pathlib import Path
 
 import pytest
 
+import pytest_replay
+from pytest_replay.consumer import Progress
+
 
 @pytest.mark.parametrize(
     "extra_option", [(None, ".pytest-replay"), ("--replay-base-name", "NEW-BASE-NAME")]
@@ -480,3 +487,504 @@ def test_non_existent_entry_in_replay_file(testdir):
     )
     # assert that tests are not run when non existent entry is found
     result.stdout.fnmatch_lines("*no tests ran*")
+
+
+def test_record_imports(testdir):
+    """--replay-record-imports attributes first-time imports to the test paying them."""
+    testdir.makepyfile(
+        heavy_module="""
+            import time
+            time.sleep(0.05)
+        """,
+        test_module="""
+            def test_first():
+                import heavy_module
+
+            def test_second():
+                import heavy_module
+        """,
+    )
+    dir = testdir.tmpdir / "replay"
+    result = testdir.runpytest_subprocess(
+        f"--replay-record-dir={dir}", "--replay-record-imports"
+    )
+    assert result.ret == 0
+
+    contents = [json.loads(s) for s in (dir / ".pytest-replay.txt").read().splitlines()]
+    imports = {r["nodeid"]: r.get("imports") for r in contents if "finish" in r}
+    first = imports["test_module.py::test_first"]
+    assert first["modules"] == 1
+    assert first["time"] >= 0.05
+    assert [name for name, _ in first["top"]] == ["heavy_module"]
+    assert imports["test_module.py::test_second"] is None
+
+    result.stdout.fnmatch_lines(
+        [
+            "*= replay import cost =*",
+            "*s spent in first-time imports across 1 tests, most expensive:",
+            "*s heavy_module (paid by test_module.py::test_first)",
+        ]
+    )
+
+    # Replaying does not carry over the import costs of the previous run.
+    new_dir = testdir.tmpdir / "replay-new"
+    result = testdir.runpytest_subprocess(
+        f"--replay={dir / '.pytest-replay.txt'}", f"--replay-record-dir={new_dir}"
+    )
+    assert result.ret == 0
+    contents = [json.loads(s) for s in (new_dir / ".pytest-replay.txt").readlines()]
+    assert all("imports" not in r for r in contents)
+
+
+def test_record_imports_from_package(testdir):
+    """``from pkg import sub`` is named after the submodule it loads."""
+    pkg = testdir.mkpydir("pkg")
+    pkg.join("heavy.py").write("import time\ntime.sleep(0.05)\n")
+    testdir.makepyfile(test_module="""
+        import pkg
+
+        def test_from_import():
+            from pkg import heavy
+    """)
+    dir = testdir.tmpdir / "replay"
+    result = testdir.runpytest_subprocess(
+        f"--replay-record-dir={dir}", "--replay-record-imports"
+    )
+    assert result.ret == 0
+    contents = [json.loads(s) for s in (dir / ".pytest-replay.txt").read().splitlines()]
+    (imports,) = [r["imports"] for r in contents if "finish" in r]
+    assert [name for name, _ in imports["top"]] == ["pkg.heavy"]
+
+
+def test_replay_order_fixtures(testdir):
+    """--replay-order=fixtures groups tests sharing module scoped parametrized fixtures."""
+    testdir.makepyfile(test_module="""
+        import pytest
+
+        @pytest.fixture(scope="module", params=["a", "b"])
+        def resource(request):
+            print(f"SETUP {request.param}")
+            return request.param
+
+        def test_one(resource):
+            pass
+
+        def test_two(resource):
+            pass
+
+        def test_other():
+            pass
+    """)
+    dir = testdir.tmpdir / "replay"
+    dir.mkdir()
+    replay_file = dir / ".pytest-replay.txt"
+    nodeids = [
+        "test_module.py::test_one[a]",
+        "test_module.py::test_other",
+        "test_module.py::test_one[b]",
+        "test_module.py::test_two[a]",
+        "test_module.py::test_two[b]",
+    ]
+    replay_file.write_text(
+        "\n".join(json.dumps({"nodeid": x}) for x in nodeids), "utf-8"
+    )
+
+    result = testdir.runpytest(f"--replay={replay_file}", "-v", "-s")
+    assert result.ret == 0
+    assert result.stdout.str().count("SETUP") == 4
+
+    result = testdir.runpytest(
+        f"--replay={replay_file}", "--replay-order=fixtures", "-v", "-s"
+    )
+    assert result.ret == 0
+    assert result.stdout.str().count("SETUP") == 2
+    result.stdout.fnmatch_lines(
+        [
+            "test_module.py::test_one?a?*",
+            "test_module.py::test_two?a?*",
+            "test_module.py::test_other*",
+            "test_module.py::test_one?b?*",
+            "test_module.py::test_two?b?*",
+        ]
+    )
+
+
+def test_check_order(testdir):
+    """--replay-check-order reports order-dependent tests and their suspected polluters."""
+    testdir.makepyfile(test_module="""
+        STATE = []
+
+        def test_polluter():
+            STATE.append(1)
+
+        def test_other():
+            pass
+
+        def test_victim():
+            assert not STATE
+
+        def test_always_fails():
+            assert False
+    """)
+    dir = testdir.tmpdir / "replay"
+    result = testdir.runpytest_subprocess(f"--replay-record-dir={dir}")
+    assert result.ret == 1
+
+    work_dir = testdir.tmpdir / "order"
+    result = testdir.runpytest_subprocess(
+        f"--replay={dir / '.pytest-replay.txt'}",
+        "--replay-check-order",
+        f"--replay-record-dir={work_dir}",
+    )
+    assert result.ret == 1
+    result.stdout.fnmatch_lines(
+        [
+            "*= replay order check =*",
+            f"* variants of 4 tests run in {work_dir}",
+            "test_module.py::test_victim is order-dependent",
+            "    failed in: original*",
+            "    passed in: reversed*isolated-2",
+            "    suspected polluters: test_module.py::test_polluter",
+            "test_module.py::test_always_fails fails in every order",
+        ]
+    )
+    assert (work_dir / "reversed.txt").check()
+    assert (work_dir / "isolated-2" / ".pytest-replay.txt").check()
+
+
+def test_check_order_forwards_options(testdir):
+    """Variants run in a single process, with the command line options of the session."""
+    testdir.makeini("""
+        [pytest]
+        addopts = -n 2
+    """)
+    testdir.makeconftest("""
+        import pytest
+
+        def pytest_addoption(parser):
+            parser.addoption("--required-option", action="store_true")
+
+        def pytest_configure(config):
+            if not config.getoption("required_option"):
+                raise pytest.UsageError("--required-option is required")
+    """)
+    testdir.makepyfile(test_module="""
+        STATE = []
+
+        def test_polluter():
+            STATE.append(1)
+
+        def test_victim():
+            assert not STATE
+    """)
+    dir = testdir.tmpdir / "replay"
+    dir.mkdir()
+    replay_file = dir / ".pytest-replay.txt"
+    replay_file.write_text(
+        "\n".join(
+            json.dumps({"nodeid": x})
+            for x in ["test_module.py::test_polluter", "test_module.py::test_victim"]
+        ),
+        "utf-8",
+    )
+    result = testdir.runpytest_subprocess(
+        f"--replay={replay_file}", "--replay-check-order", "--required-option"
+    )
+    assert result.ret == 1
+    result.stdout.fnmatch_lines(
+        [
+            "test_module.py::test_victim is order-dependent",
+            "    suspected polluters: test_module.py::test_polluter",
+        ]
+    )
+
+    # Variants failing to run must not be reported as "no order-dependent tests".
+    testdir.makeconftest("""
+        import pytest
+
+        def pytest_addoption(parser):
+            parser.addoption("--required-option", action="store_true")
+
+        def pytest_configure(config):
+            if config.getoption("replay_record_dir"):
+                raise pytest.UsageError("broken variant")
+    """)
+    result = testdir.runpytest_subprocess(
+        f"--replay={replay_file}", "--replay-check-order", "--required-option"
+    )
+    assert result.ret == pytest.ExitCode.INTERNAL_ERROR
+    result.stdout.fnmatch_lines(
+        ["*order check variant '*' failed with exit code 4, see *.log*"]
+    )
+    assert "no order-dependent tests found" not in result.stdout.str()
+
+
+def test_check_order_ignores_replay_addopts(testdir):
+    """Variants record and order their tests regardless of the options in addopts."""
+    testdir.makeini("""
+        [pytest]
+        addopts = --replay-base-name=myrec --replay-keep-runs=1 --replay-order=fixtures
+    """)
+    testdir.makepyfile(test_module="""
+        import pytest
+
+        STATE = []
+
+        @pytest.fixture(scope="module")
+        def resource():
+            pass
+
+        def test_polluter():
+            STATE.append(1)
+
+        def test_victim(resource, tmp_path):
+            (tmp_path / "file").touch()
+            assert not STATE
+    """)
+    replay_file = testdir.tmpdir / "replay.txt"
+    replay_file.write_text(
+        "\n".join(
+            json.dumps({"nodeid": x})
+            for x in ["test_module.py::test_polluter", "test_module.py::test_victim"]
+        ),
+        "utf-8",
+    )
+    dir = testdir.tmpdir / "replay"
+    result = testdir.runpytest_subprocess(
+        f"--replay={replay_file}", "--replay-check-order", f"--replay-record-dir={dir}"
+    )
+    assert result.ret == 1
+    result.stdout.fnmatch_lines(
+        [
+            "test_module.py::test_victim is order-dependent",
+            "    failed in: original, shuffle-0",
+            "    passed in: reversed, shuffle-1, shuffle-2, isolated-1",
+        ]
+    )
+    (run_dir,) = [x for x in dir.listdir() if x.isdir()]
+    assert (run_dir / "original" / ".pytest-replay.txt").exists()
+    assert (run_dir / "original-tmp").isdir()
+
+
+def test_check_order_requires_replay(testdir):
+    result = testdir.runpytest("--replay-check-order")
+    assert result.ret == pytest.ExitCode.USAGE_ERROR
+    result.stderr.fnmatch_lines("ERROR: --replay-check-order requires --replay.")
+
+
+@pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="requires Unix sockets")
+def test_stream(suite, testdir):
+    """Records are also published to the --replay-stream socket."""
+    dir = testdir.tmpdir / "replay"
+    path = str(testdir.tmpdir / "replay.sock")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+        sock.bind(path)
+        result = testdir.runpytest(
+            "test_1.py", f"--replay-record-dir={dir}", f"--replay-stream={path}"
+        )
+        assert result.ret == 0
+        sock.setblocking(False)
+        messages = [json.loads(sock.recv(65536)) for _ in range(4)]
+        with pytest.raises(BlockingIOError):
+            sock.recv(65536)
+
+    replay_file = dir / ".pytest-replay.txt"
+    records = [json.loads(line) for line in replay_file.readlines()]
+    assert messages == [{"worker": "", "record": record} for record in records]
+
+    progress = Progress.from_history([str(replay_file)])
+    progress.feed(messages[0])
+    assert progress.running == {"test_1.py::test_foo": ""}
+    progress.feed(messages[1])
+    assert progress.finished == {"test_1.py::test_foo": "passed"}
+    assert progress.status_line().startswith("1/2 finished, 0 failed, 0 running, ETA")
+
+
+@pytest.mark.skipif(not hasattr(os, "mkfifo"), reason="requires named pipes")
+@pytest.mark.parametrize("xdist", [True, False])
+def test_stream_without_reader(suite, testdir, xdist):
+    """Records are dropped and counted when nobody reads the --replay-stream pipe."""
+    path = str(testdir.tmpdir / "replay.fifo")
+    os.mkfifo(path)
+    args = ["--replay-record-dir=replay", f"--replay-stream={path}"]
+    if xdist:
+        args += ["-n", "2"]
+    result = testdir.runpytest_subprocess(*args)
+    assert result.ret == 0
+    result.stdout.fnmatch_lines(
+        [f"replay: 8 records could not be published to {path}", "*= 4 passed in *="]
+    )
+
+
+@pytest.mark.parametrize("xdist", [True, False])
+def test_stats(suite, testdir, xdist):
+    """--replay-stats shows the overhead of the plugin hooks, including xdist workers."""
+    testdir.makeconftest("""
+        def pytest_sessionfinish(session):
+            replay = session.config.pluginmanager.get_plugin("replay-writer")
+            stats = replay.stats["append_test_to_script"]
+            print(f"append calls: {stats.calls}")
+        """)
+    args = ["--replay-record-dir=replay", "--replay-stats", "-s"]
+    if xdist:
+        args += ["-n", "2"]
+    result = testdir.runpytest_subprocess(*args)
+    assert result.ret == 0
+    result.stdout.fnmatch_lines(
+        [
+            "*= replay plugin overhead =*",
+            "* calls * total * max * written",
+            # Same counts with xdist: only calls doing some work are measured.
+            "pytest_runtest_logstart * 4 * 0.*s * 0.*s * 0",
+            "pytest_runtest_makereport * 12 *",
+            "pytest_collection_modifyitems * 0 *",
+            "cleanup_scripts * 1 *",
+            "append_test_to_script * 8 * 0.*s * 0.*s * [1-9]*",
+        ]
+    )
+    if not xdist:
+        result.stdout.fnmatch_lines(["*append calls: 8"])
+
+
+def test_stats_exclusive(monkeypatch):
+    """The time of nested measured calls is only counted in the innermost one."""
+    now = 0.0
+    monkeypatch.setattr(pytest_replay, "_clock", lambda: now)
+    outer, inner = pytest_replay.ReplayHookStats(), pytest_replay.ReplayHookStats()
+    with outer.measure():
+        now += 1.0
+        with inner.measure():
+            now += 2.0
+        now += 4.0
+    assert (outer.calls, outer.total, outer.max) == (1, 5.0, 5.0)
+    assert (inner.calls, inner.total, inner.max) == (1, 2.0, 2.0)
+
+
+@pytest.mark.parametrize("xdist", [True, False])
+def test_keep_runs(suite, testdir, xdist):
+    """--replay-keep-runs records each run in its own directory, listed in an index."""
+    dir = testdir.tmpdir / "replay"
+    args = [f"--replay-record-dir={dir}", "--replay-keep-runs=2"]
+    expected_files = [".pytest-replay.txt"]
+    if xdist:
+        args += ["-n", "2"]
+        expected_files = [".pytest-replay-gw0.txt", ".pytest-replay-gw1.txt"]
+
+    names = []
+    for _ in range(3):
+        result = testdir.runpytest_subprocess(*args)
+        assert result.ret == 0
+        match = re.search(r"replay run: (\S+)", result.stdout.str())
+        names.append(match.group(1))
+
+    runs = json.loads((dir / ".pytest-replay-runs.json").read())["runs"]
+    assert [run["name"] for run in runs] == names[:0:-1]
+    assert {x.basename for x in dir.listdir()} == {
+        ".pytest-replay-runs.json",
+        *names[1:],
+    }
+    for run in runs:
+        assert run["files"] == expected_files
+        assert run["bytes"] == sum((dir / run["name"] / f).size() for f in run["files"])
+        assert run["exitstatus"] == 0
+        # Each run only has its own records: a start and a finish line per test.
+        lines = [
+            line for f in run["files"] for line in (dir / run["name"] / f).readlines()
+        ]
+        assert len(lines) == 8
+
+
+def test_keep_bytes(suite, testdir):
+    """--replay-keep-bytes removes the oldest runs once they take too much space."""
+    dir = testdir.tmpdir / "replay"
+    for _ in range(2):
+        result = testdir.runpytest(
+            f"--replay-record-dir={dir}", "--replay-keep-bytes=1K"
+        )
+        assert result.ret == 0
+    runs = json.loads((dir / ".pytest-replay-runs.json").read())["runs"]
+    assert len(runs) == 2
+
+    result = testdir.runpytest(f"--replay-record-dir={dir}", "--replay-keep-bytes=1")
+    assert result.ret == 0
+    runs = json.loads((dir / ".pytest-replay-runs.json").read())["runs"]
+    assert len(runs) == 1
+    assert len(dir.listdir()) == 2
+
+
+def test_keep_runs_unfinished(suite, testdir):
+    """Unfinished runs are only removed once the session recording them is gone."""
+    dir = testdir.tmpdir / "replay"
+    finished = subprocess.Popen([sys.executable, "-c", "pass"])
+    finished.wait()
+    runs = []
+    for name, pid in [("running", os.getpid()), ("crashed", finished.pid)]:
+        (dir / name).ensure(".pytest-replay.txt")
+        host = socket.gethostname()
+        runs.append(
+            {"name": name, "start": "2026-10-19T10:00:00", "host": host, "pid": pid}
+        )
+    (dir / ".pytest-replay-runs.json").write_text(json.dumps({"runs": runs}), "utf-8")
+
+    result = testdir.runpytest(f"--replay-record-dir={dir}", "--replay-keep-runs=1")
+    assert result.ret == 0
+    runs = json.loads((dir / ".pytest-replay-runs.json").read())["runs"]
+    assert [run["name"] for run in runs][1:] == ["running"]
+    assert (dir / "running").isdir()
+    assert not (dir / "crashed").exists()
+
+
+def test_keep_runs_concurrent(suite, testdir):
+    """Sessions sharing a record directory do not lose each other's index entries."""
+    dir = testdir.tmpdir / "replay"
+    processes = [
+        subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "pytest",
+                f"--replay-record-dir={dir}",
+                "--replay-keep-runs=10",
+                "-p",
+                "no:cacheprovider",
+            ],
+            cwd=str(testdir.tmpdir),
+            stdout=subprocess.DEVNULL,
+        )
+        for _ in range(4)
+    ]
+    assert [p.wait() for p in processes] == [0] * 4
+    runs = json.loads((dir / ".pytest-replay-runs.json").read())["runs"]
+    assert len(runs) == 4
+    assert all(run["exitstatus"] == 0 for run in runs)
+    assert len(dir.listdir()) == 5
+
+
+def test_stream_requires_record_dir(testdir):
+    result = testdir.runpytest("--replay-stream=replay.sock")
+    assert result.ret == pytest.ExitCode.USAGE_ERROR
+    result.stderr.fnmatch_lines("ERROR: --replay-stream requires --replay-record-dir.")
+
+
+@pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="requires Unix sockets")
+def test_stream_drops_large_records(testdir):
+    """Records too large to be received whole are not published."""
+    testdir.makepyfile("""
+        def test_large(replay_metadata):
+            replay_metadata.metadata["data"] = "x" * 100000
+    """)
+    path = str(testdir.tmpdir / "replay.sock")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+        sock.bind(path)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024 * 1024)
+        result = testdir.runpytest(
+            "--replay-record-dir=replay", f"--replay-stream={path}"
+        )
+        assert result.ret == 0
+        sock.setblocking(False)
+        # Only the start record, the finish one has the large metadata.
+        message = json.loads(sock.recv(65536))
+        assert "finish" not in message["record"]
+        with pytest.raises(BlockingIOError):
+            sock.recv(65536)
+    result.stdout.fnmatch_lines([f"replay: 1 records could not be published to {path}"])
@@ -1,3 +1,4 @@
+import os
 import re
 
 import pytest
@@ -63,3 +64,104 @@ def test_exception_multiple_replay_files(testdir, suite_replay_xdist, extra_args
     file_gw0, file_gw1 = suite_replay_xdist
     result = testdir.runpytest("--replay", str(file_gw0), str(file_gw1), *extra_args)
     assert result.ret == 4
+
+
+@pytest.mark.parametrize("rerun", [True, False])
+def test_crashed_worker(testdir, rerun):
+    """The replay file of a crashed worker is reported and optionally re-run."""
+    testdir.makepyfile(test_crash="""
+        import os
+        import pytest
+
+        @pytest.mark.parametrize("i", range(4))
+        def test_normal(i):
+            pass
+
+        def test_crash():
+            os._exit(1)
+    """)
+    # Given in addopts, which the rerun must not use to distribute the sequence.
+    testdir.makeini("""
+        [pytest]
+        addopts = -n 2
+    """)
+    dir = testdir.tmpdir / "replay"
+    args = [f"--replay-record-dir={dir}"]
+    if rerun:
+        args.append("--replay-rerun-crashed")
+    result = testdir.runpytest_subprocess(*args)
+    assert result.ret == 1
+
+    match = re.search(
+        r"(gw\d) crashed while running test_crash\.py::test_crash, replay with:",
+        result.stdout.str(),
+    )
+    assert match
+    script = dir / f".pytest-replay-{match.group(1)}.txt"
+    result.stdout.fnmatch_lines([f"*pytest --replay={script}"])
+    log = dir / f".pytest-replay-{match.group(1)}-rerun.log"
+    if rerun:
+        result.stdout.fnmatch_lines([f"*rerun exited with code 1, log: {log}"])
+        # The sequence is replayed in a single process.
+        log_contents = log.read()
+        assert "test_crash.py" in log_contents
+        assert "workers" not in log_contents
+    else:
+        assert not log.exists()
+
+
+def test_crashed_worker_rerun_ignores_replay_addopts(testdir):
+    """The rerun does not record to or prune the runs of the session launching it."""
+    testdir.makepyfile(test_crash="""
+        import os
+
+        def test_normal():
+            pass
+
+        def test_crash():
+            os._exit(1)
+    """)
+    dir = testdir.tmpdir / "replay"
+    testdir.makeini(f"""
+        [pytest]
+        addopts = -n 2 --replay-record-dir={dir} --replay-keep-runs=1
+    """)
+    result = testdir.runpytest_subprocess("--replay-rerun-crashed")
+    assert result.ret == 1
+    match = re.search(r"(gw\d) crashed while running", result.stdout.str())
+    assert match
+    (run_dir,) = [x for x in dir.listdir() if x.isdir()]
+    script = run_dir / f".pytest-replay-{match.group(1)}.txt"
+    assert script.exists()
+    rerun_dir = run_dir / f".pytest-replay-{match.group(1)}-rerun"
+    result.stdout.fnmatch_lines([f"*rerun exited with code 1, log: {rerun_dir}.log"])
+    assert "test_crash.py::test_crash" in (rerun_dir / ".pytest-replay.txt").read()
+
+
+def test_crashed_worker_rerun_timeout(testdir):
+    """A rerun still running after --replay-rerun-timeout is terminated."""
+    testdir.makepyfile(test_crash="""
+        import os
+        import time
+
+        def test_crash():
+            if os.environ.get("PYTEST_REPLAY_LAUNCHED"):
+                time.sleep(60)
+            os._exit(1)
+    """)
+    dir = testdir.tmpdir / "replay"
+    result = testdir.runpytest_subprocess(
+        f"--replay-record-dir={dir}",
+        "--replay-rerun-crashed",
+        "--replay-rerun-timeout=0.5",
+        "-n",
+        "1",
+    )
+    assert result.ret == 1
+    result.stdout.fnmatch_lines(
+        [
+            "*pytest --replay=*",
+            "    rerun did not finish within 0.5s and was terminated, log: "
+            f"{dir}{os.sep}.pytest-replay-gw0-rerun.log",
+        ]
+    )